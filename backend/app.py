@@ -1,58 +1,65 @@
 import os
+import re
 from datetime import datetime
+from functools import lru_cache
 
-from flask import Flask, Response, abort
+from flask import Flask, Response, abort, request, send_file
 from flask_cors import CORS
 
 # ---- Fixed ERA5 grid (0.25° global) ----
 NX = 1440                    # longitudes (0.25° from 0..359.75)
 NY = 721                     # latitudes (0.25° from 90..-90)
 BOUNDS = (-180.0, -90.0, 179.75, 90.0)  # [minLon, minLat, maxLon, maxLat]
+BOUNDS_HEADER = ",".join(map(str, BOUNDS))
+SIZE_HEADER = f"{NX}x{NY}"
+
+# ---- PNG serving ----
+CACHE_MAX_AGE = 0            # frames are regenerated in place; revalidate via ETag every time
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+
+UV_IMAGE_DIR = os.path.join(DATA_DIR, "uv_images", "250")
+LANDMASK_IMAGE_PATH = os.path.join(DATA_DIR, "landMask.png")
 
 def resolve_gph_image_dir(pressure_level: str) -> str:
-    here = os.path.dirname(os.path.abspath(__file__))
-    root = os.path.abspath(os.path.join(here, os.pardir))
-    out_dir = os.path.join(root, "data", "gphImages", str(pressure_level))
-    os.makedirs(out_dir, exist_ok=True)
-    return out_dir
+    return os.path.join(DATA_DIR, "gphImages", str(pressure_level))
 
 def resolve_uv_image_dir() -> str:
-    here = os.path.dirname(os.path.abspath(__file__))
-    root = os.path.abspath(os.path.join(here, os.pardir))
-    out_dir = os.path.join(root, "data", "uv_images", "250")
-    os.makedirs(out_dir, exist_ok=True)
-    return out_dir
+    return UV_IMAGE_DIR
 
 def resolve_landmask_image_path() -> str:
-    here = os.path.dirname(os.path.abspath(__file__))
-    root = os.path.abspath(os.path.join(here, os.pardir))
-    out_path = os.path.join(root, "data", "landMask.png")
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    return out_path
+    return LANDMASK_IMAGE_PATH
+
+# YYYY-MM-DDTHH[:MM] or YYYY-MM-DD HH[:MM] (trailing Z stripped beforehand)
+ISO_DATEHOUR_RE = re.compile(r"([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})[T ]([0-9]{1,2})(?::([0-9]{1,2}))?")
 
+@lru_cache(maxsize=4096)
 def parse_datehour(value: str):
     v = value.strip()
-    from datetime import datetime
-    if v.isdigit():
-        if len(v) == 10:
-            return datetime.strptime(v, "%Y%m%d%H")
-        elif len(v) == 12:
-            return datetime.strptime(v, "%Y%m%d%H%M")
-    iso = v.rstrip("Z")
-    for fmt in ("%Y-%m-%dT%H", "%Y-%m-%d %H", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M"):
-        try:
-            return datetime.strptime(iso, fmt)
-        except ValueError:
-            pass
+    if v.isdigit() and len(v) in (10, 12):
+        # YYYYMMDDHH[MM]: slice the fields directly rather than going through strptime
+        return datetime(int(v[0:4]), int(v[4:6]), int(v[6:8]), int(v[8:10]), int(v[10:12] or 0))
+    m = ISO_DATEHOUR_RE.fullmatch(v.rstrip("Z"))
+    if m:
+        year, month, day, hour, minute = m.groups()
+        return datetime(int(year), int(month), int(day), int(hour), int(minute or 0))
     raise ValueError(f"Unsupported datehour format: {value}")
 
 def create_app() -> Flask:
     app = Flask(__name__)
+    # Create the serving dirs once here; the routes only read, so a missing file is just a 404
+    os.makedirs(os.path.join(DATA_DIR, "gphImages"), exist_ok=True)
+    os.makedirs(UV_IMAGE_DIR, exist_ok=True)
+    # Behind a front server that understands X-Sendfile, let it stream the PNG from disk
+    app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
     CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Bounds", "X-Size"])
 
+    @app.after_request
     def add_headers(resp: Response) -> Response:
-        resp.headers["X-Bounds"] = ",".join(map(str, BOUNDS))
-        resp.headers["X-Size"] = f"{NX}x{NY}"
+        # Every image served here is on the same fixed grid
+        if resp.mimetype.startswith("image/"):
+            resp.headers["X-Bounds"] = BOUNDS_HEADER
+            resp.headers["X-Size"] = SIZE_HEADER
         return resp
 
     @app.get("/gph/<pressureLevel>/<datehour>")
@@ -63,13 +70,23 @@ def create_app() -> Flask:
             abort(400, description="Invalid datehour format")
 
         ts = dt.strftime("%Y%m%d%H")
-        image_path = os.path.join(resolve_gph_image_dir(pressureLevel), f"gph_{ts}.png")
-        if not os.path.exists(image_path):
+        image_dir = resolve_gph_image_dir(pressureLevel)
+        # Lossless WebP carries the same Terrain-RGB bytes; only sent to clients that ask for it explicitly
+        if any(mimetype == "image/webp" and quality > 0 for mimetype, quality in request.accept_mimetypes):
+            try:
+                resp = send_file(os.path.join(image_dir, f"gph_{ts}.webp"), mimetype="image/webp", conditional=True, max_age=CACHE_MAX_AGE)
+                resp.vary.add("Accept")
+                return resp
+            except FileNotFoundError:
+                pass
+
+        # send_file stats the file anyway; let that stat double as the existence check
+        try:
+            resp = send_file(os.path.join(image_dir, f"gph_{ts}.png"), mimetype="image/png", conditional=True, max_age=CACHE_MAX_AGE)
+        except FileNotFoundError:
             abort(404, description="image doesn't exist")
-
-        with open(image_path, "rb") as f:
-            data = f.read()
-        return add_headers(Response(data, mimetype="image/png"))
+        resp.vary.add("Accept")
+        return resp
 
     @app.get("/uv/<datehour>")
     def uv(datehour: str):
@@ -80,23 +97,18 @@ def create_app() -> Flask:
 
         ts = dt.strftime("%Y%m%d%H")
         image_path = os.path.join(resolve_uv_image_dir(), f"uv_{ts}.png")
-        if not os.path.exists(image_path):
+        try:
+            return send_file(image_path, mimetype="image/png", conditional=True, max_age=CACHE_MAX_AGE)
+        except FileNotFoundError:
             abort(404, description="image doesn't exist")
 
-        with open(image_path, "rb") as f:
-            data = f.read()
-        return add_headers(Response(data, mimetype="image/png"))
-
     @app.get("/landMask")
     def land_mask():
-        image_path = resolve_landmask_image_path()
-        if not os.path.exists(image_path):
+        try:
+            return send_file(resolve_landmask_image_path(), mimetype="image/png", conditional=True, max_age=CACHE_MAX_AGE)
+        except FileNotFoundError:
             abort(404, description="image doesn't exist")
 
-        with open(image_path, "rb") as f:
-            data = f.read()
-        return add_headers(Response(data, mimetype="image/png"))
-
     return app
 
 app = create_app()
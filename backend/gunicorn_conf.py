@@ -0,0 +1,10 @@
+# Production server config:  cd backend && gunicorn -c gunicorn_conf.py app:app
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8001)}"
+
+# Requests are stat + sendfile, so threads in one process cover concurrency;
+# add workers (WEB_CONCURRENCY) only if a single process becomes CPU-bound.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("THREADS", 8))
+worker_class = "gthread"
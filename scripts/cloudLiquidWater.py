@@ -1,5 +1,5 @@
-import io
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 import numpy as np
@@ -7,6 +7,10 @@ import xarray as xr
 from PIL import Image
 
 
+# Frames encode independently; one worker per core
+WORKERS: int = os.cpu_count() or 1
+
+
 def resolve_paths():
     """Return absolute paths for project root, data dir, grib path, and output dir."""
     here = os.path.dirname(os.path.abspath(__file__))
@@ -19,8 +23,14 @@ def resolve_paths():
 
 
 def open_era5_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -67,42 +77,77 @@ def select_liq_ice(ds: xr.Dataset):
 
 def to_minus180_180(lon_1d: np.ndarray, arr: np.ndarray):
     """Shift longitudes from [0,360] to [-180,180] while rolling array columns accordingly."""
-    lon = lon_1d.copy()
+    lon = lon_1d
     nx = lon.size
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
         return lon, arr
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((arr[..., cut:], arr[..., :cut]), axis=-1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    arr_rot = np.roll(arr, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
-    return lon_rot[order], arr_rot[:, order]
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    return lon_rot[order], arr[..., (order - shift) % nx]
+
+
+# Per-process scratch arrays, reused across frames
+_scratch_buffers: dict = {}
 
 
-def encode_liq_ice_png(tclw2d: np.ndarray, tciw2d: np.ndarray):
+def scratch_buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    key = (name, shape, np.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = _scratch_buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def liq_ice_rgba_image(tclw2d: np.ndarray, tciw2d: np.ndarray) -> Image.Image:
     """
-    Encode as RGBA:
+    RGBA image:
       R = liquid (0–1)
       G = ice (0–0.3)
     """
-    L = np.nan_to_num(tclw2d, nan=0.0)
-    I = np.nan_to_num(tciw2d, nan=0.0)
+    ny, nx = tclw2d.shape
+    rgba = scratch_buffer("rgba", (ny, nx, 4), np.uint8)
+    rgba[..., 2] = 0
+    rgba[..., 3] = 255
+    tmp = scratch_buffer("tmp", (ny, nx), np.float32)
+
+    def to_u8(x, scale_max, out):
+        # Scale straight to 0..255 in one pass, then NaN->0, clip and round in place
+        np.multiply(x, np.float32(255.0 / scale_max), out=tmp)
+        np.nan_to_num(tmp, copy=False, nan=0.0)
+        np.clip(tmp, 0.0, 255.0, out=tmp)
+        np.rint(tmp, out=tmp)
+        np.copyto(out, tmp, casting="unsafe")
+
+    to_u8(tclw2d, 1.0, rgba[..., 0])
+    to_u8(tciw2d, 0.3, rgba[..., 1])
 
-    def to_u8(x, scale_max):
-        return np.rint(np.clip(x / scale_max, 0.0, 1.0) * 255.0).astype(np.uint8)
+    return Image.fromarray(rgba, mode="RGBA")
 
-    r = to_u8(L, 1.0)
-    g = to_u8(I, 0.3)
-    b = np.zeros_like(r, dtype=np.uint8)
-    a = np.full_like(r, 255, dtype=np.uint8)
 
-    rgba = np.dstack([r, g, b, a])
-    image = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.read()
+def timestamp_strings(times: np.ndarray) -> np.ndarray:
+    """YYYYMMDDHH for every timestep, formatted in one vectorized pass."""
+    iso = np.datetime_as_string(times, unit="h")  # YYYY-MM-DDTHH
+    return np.char.replace(np.char.replace(iso, "-", ""), "T", "")
+
+
+def write_liq_ice_png(job) -> str:
+    png_path, tclw2d, tciw2d = job
+    # zlib level 1: much faster, slightly larger
+    liq_ice_rgba_image(tclw2d, tciw2d).save(png_path, format="PNG", compress_level=1, optimize=False)
+    return png_path
 
 
 def main():
@@ -119,32 +164,28 @@ def main():
 
     print(f"Dataset time range: {np.datetime_as_string(times[0], unit='h')} .. {np.datetime_as_string(times[-1], unit='h')}")
 
-    lat_work = lat.copy()
-    flip_lat = lat_work[0] < lat_work[-1]
-    if flip_lat:
-        lat_work = lat_work[::-1]
-
-    total = len(times)
-    for idx, t in enumerate(times, start=1):
-        ts = np.datetime_as_string(t, unit="h").replace("-", "").replace(":", "").replace("T", "")
-        png_path = os.path.join(out_dir, f"clouds_liq-ice_{ts}.png")
-
-        L2d = tclw.sel({time_coord: np.datetime64(t)}).values.astype(np.float32)
-        I2d = tciw.sel({time_coord: np.datetime64(t)}).values.astype(np.float32)
-
-        if flip_lat:
-            L2d = L2d[::-1, :]
-            I2d = I2d[::-1, :]
+    # clip already loaded the fields; take the cubes once
+    L_all = tclw.transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+    I_all = tciw.transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
 
-        lon_fixed, L2d = to_minus180_180(lon, L2d)
-        _,         I2d = to_minus180_180(lon, I2d)
+    # Flip north-up and shift to [-180,180) once for the whole cube
+    if lat[0] < lat[-1]:
+        L_all = L_all[:, ::-1, :]
+        I_all = I_all[:, ::-1, :]
+    _,         L_all = to_minus180_180(lon, L_all)
+    _,         I_all = to_minus180_180(lon, I_all)
 
-        png_bytes = encode_liq_ice_png(L2d, I2d)
-        with open(png_path, "wb") as f:
-            f.write(png_bytes)
-
-        if idx % 50 == 0 or idx == total:
-            print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
+    total = len(times)
+    stamps = timestamp_strings(times)
+    jobs = (
+        (os.path.join(out_dir, f"clouds_liq-ice_{ts}.png"), L_all[i], I_all[i])
+        for i, ts in enumerate(stamps)
+    )
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        # map keeps time order
+        for idx, png_path in enumerate(pool.map(write_liq_ice_png, jobs, chunksize=4), start=1):
+            if idx % 50 == 0 or idx == total:
+                print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import xarray as xr
+
+
+def resolve_paths():
+    """Return absolute paths for the source GRIB and the Zarr store written next to it."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = os.path.abspath(os.path.join(here, os.pardir))
+    data_dir = os.path.join(root, "data")
+    grib_path = os.path.join(data_dir, "data.grib")
+    zarr_path = grib_path + ".zarr"
+    return grib_path, zarr_path
+
+
+def time_chunked_encoding(ds: xr.Dataset) -> dict:
+    """One chunk per timestep so a single (lat, lon) slice is one read."""
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        chunks = tuple(1 if dim in ("time", "valid_time") else size for dim, size in zip(da.dims, da.shape))
+        encoding[name] = {"chunks": chunks}
+    return encoding
+
+
+def convert(grib_path: str, zarr_path: str):
+    if not os.path.exists(grib_path):
+        raise FileNotFoundError(f"GRIB file not found: {grib_path}")
+    ds = xr.open_dataset(grib_path, engine="cfgrib")
+    for da in ds.variables.values():
+        # cfgrib-specific encodings (source file, chunk hints) don't apply to the Zarr store
+        da.encoding = {}
+    # Zarr v2 keeps consolidated metadata in-spec, so zarr 3 neither warns on write nor falls back on read
+    ds.to_zarr(zarr_path, mode="w", encoding=time_chunked_encoding(ds), zarr_format=2)
+
+
+def main():
+    # Every preprocess script's dataset opener picks up "<grib>.zarr" while it is newer than the GRIB.
+    # Defaults to data/data.grib; pass other GRIB paths as arguments to convert those too.
+    if len(sys.argv) > 1:
+        grib_paths = [os.path.abspath(p) for p in sys.argv[1:]]
+    else:
+        grib_paths = [resolve_paths()[0]]
+    for grib_path in grib_paths:
+        zarr_path = grib_path + ".zarr"
+        convert(grib_path, zarr_path)
+        print(f"Wrote {zarr_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-import io
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 import numpy as np
@@ -7,6 +7,10 @@ import xarray as xr
 from PIL import Image
 
 
+# Frames encode independently; one worker per core
+WORKERS: int = os.cpu_count() or 1
+
+
 def resolve_paths():
     """Return absolute paths for project root, data dir, grib path, and output dir."""
     here = os.path.dirname(os.path.abspath(__file__))
@@ -19,8 +23,14 @@ def resolve_paths():
 
 
 def open_era5_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -75,45 +85,76 @@ def select_lmh_cloud(ds: xr.Dataset):
 
 def to_minus180_180(lon_1d: np.ndarray, arr: np.ndarray):
     """Shift longitudes from [0,360] to [-180,180] while rolling array columns accordingly."""
-    lon = lon_1d.copy()
+    lon = lon_1d
     nx = lon.size
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
         return lon, arr
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((arr[..., cut:], arr[..., :cut]), axis=-1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    arr_rot = np.roll(arr, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
-    return lon_rot[order], arr_rot[:, order]
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    return lon_rot[order], arr[..., (order - shift) % nx]
+
+
+# Per-process scratch arrays, reused across frames
+_scratch_buffers: dict = {}
+
 
+def scratch_buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    key = (name, shape, np.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = _scratch_buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
 
-def encode_lmh_rgb_png(lcc2d: np.ndarray, mcc2d: np.ndarray, hcc2d: np.ndarray):
+
+def lmh_rgba_image(lcc2d: np.ndarray, mcc2d: np.ndarray, hcc2d: np.ndarray) -> Image.Image:
     """
-    Inputs are 2D arrays in 0..1. Outputs an opaque RGBA PNG byte buffer where:
+    Inputs are 2D arrays in 0..1. Outputs an opaque RGBA image where:
     R = low, G = medium, B = high.
     """
-    # NaNs -> 0
-    l = np.nan_to_num(lcc2d, nan=0.0)
-    m = np.nan_to_num(mcc2d, nan=0.0)
-    h = np.nan_to_num(hcc2d, nan=0.0)
+    # Write channels straight into one RGBA buffer (no alpha plane + dstack copy)
+    rgba = scratch_buffer("rgba", lcc2d.shape + (4,), np.uint8)
+    rgba[..., 3] = 255
+    tmp = scratch_buffer("tmp", lcc2d.shape, np.float32)
+
+    # scale to 0..255 in one scratch array: x*255 + 0.5, NaNs -> 0, clip, then the uint8 cast truncates (round half up)
+    def to_u8(x, out):
+        np.multiply(x, np.float32(255.0), out=tmp)
+        np.add(tmp, np.float32(0.5), out=tmp)
+        np.nan_to_num(tmp, copy=False, nan=0.0)
+        np.clip(tmp, 0.0, 255.0, out=tmp)
+        np.copyto(out, tmp, casting="unsafe")
+
+    to_u8(lcc2d, rgba[..., 0])
+    to_u8(mcc2d, rgba[..., 1])
+    to_u8(hcc2d, rgba[..., 2])
+
+    return Image.fromarray(rgba, mode="RGBA")
+
 
-    # scale to 0..255 (round, then clip)
-    def to_u8(x):
-        y = np.rint(np.clip(x, 0.0, 1.0) * 255.0).astype(np.uint8)
-        return y
+def timestamp_strings(times: np.ndarray) -> np.ndarray:
+    """YYYYMMDDHH for every timestep, formatted in one vectorized pass."""
+    iso = np.datetime_as_string(times, unit="h")  # YYYY-MM-DDTHH
+    return np.char.replace(np.char.replace(iso, "-", ""), "T", "")
 
-    r = to_u8(l)
-    g = to_u8(m)
-    b = to_u8(h)
-    a = np.full_like(r, 255, dtype=np.uint8)
 
-    rgba = np.dstack([r, g, b, a])
-    image = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.read()
+def write_lmh_png(job) -> str:
+    png_path, l2d, m2d, h2d = job
+    # zlib level 1: much faster, slightly larger
+    lmh_rgba_image(l2d, m2d, h2d).save(png_path, format="PNG", compress_level=1, optimize=False)
+    return png_path
 
 
 def main():
@@ -121,6 +162,7 @@ def main():
     grib_path = "/mnt/c/Users/dmmsp/Downloads/data.grib"
     out_dir   = "/mnt/c/Users/dmmsp/Projects/Hurricane-Explainer-Engine/data/cloudCover"
     # _, _, grib_path, out_dir = resolve_paths()
+    skip_existing = True  # keep frames written by an earlier run; set False to regenerate everything
 
     ds = open_era5_dataset(grib_path)
     lcc, mcc, hcc, time_coord = select_lmh_cloud(ds)
@@ -145,37 +187,44 @@ def main():
         pass
 
     # Ensure latitude descending (north->south) for output consistency
-    lat_work = lat.copy()
-    flip_lat = False
-    if lat_work[0] < lat_work[-1]:
-        flip_lat = True
-        lat_work = lat_work[::-1]
-
-    total = len(times)
-    for idx, t in enumerate(times, start=1):
-        ts = np.datetime_as_string(t, unit="h").replace("-", "").replace(":", "").replace("T", "")
-        png_path = os.path.join(out_dir, f"clouds_lmh_{ts}.png")
-
-        l2d = lcc.sel({time_coord: np.datetime64(t)}).values.astype(np.float32)
-        m2d = mcc.sel({time_coord: np.datetime64(t)}).values.astype(np.float32)
-        h2d = hcc.sel({time_coord: np.datetime64(t)}).values.astype(np.float32)
-
-        if flip_lat:
-            l2d = l2d[::-1, :]
-            m2d = m2d[::-1, :]
-            h2d = h2d[::-1, :]
-
-        # Shift longitude to [-180,180] and apply same roll/order to all three channels
-        lon_fixed, l2d = to_minus180_180(lon, l2d)
-        _,         m2d = to_minus180_180(lon, m2d)
-        _,         h2d = to_minus180_180(lon, h2d)
-
-        png_bytes = encode_lmh_rgb_png(l2d, m2d, h2d)
-        with open(png_path, "wb") as f:
-            f.write(png_bytes)
-
-        if idx % 50 == 0 or idx == total:
-            print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
+    flip_lat = lat[0] < lat[-1]
+
+    # Skip frames already on disk before any slicing
+    png_paths = []
+    for ts in timestamp_strings(times):
+        png_paths.append(os.path.join(out_dir, f"clouds_lmh_{ts}.png"))
+    todo = [i for i, png_path in enumerate(png_paths) if not (skip_existing and os.path.exists(png_path))]
+    if len(todo) < len(times):
+        print(f"Skipping {len(times) - len(todo)} existing frames")
+    if not todo:
+        return
+    total = len(todo)
+
+    # clip already loaded the fields; take the cubes once
+    lcc_all = lcc.transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+    mcc_all = mcc.transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+    hcc_all = hcc.transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+    if total < len(times):
+        lcc_all = lcc_all[todo]
+        mcc_all = mcc_all[todo]
+        hcc_all = hcc_all[todo]
+
+    # Flip north-up and shift to [-180,180) once for the whole cube
+    if flip_lat:
+        lcc_all = lcc_all[:, ::-1, :]
+        mcc_all = mcc_all[:, ::-1, :]
+        hcc_all = hcc_all[:, ::-1, :]
+    _,         lcc_all = to_minus180_180(lon, lcc_all)
+    _,         mcc_all = to_minus180_180(lon, mcc_all)
+    _,         hcc_all = to_minus180_180(lon, hcc_all)
+
+    jobs = [(png_paths[i], lcc_all[j], mcc_all[j], hcc_all[j]) for j, i in enumerate(todo)]
+
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        # map keeps time order
+        for idx, png_path in enumerate(pool.map(write_lmh_png, jobs, chunksize=4), start=1):
+            if idx % 50 == 0 or idx == total:
+                print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
 
 
 if __name__ == "__main__":
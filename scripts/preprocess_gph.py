@@ -1,5 +1,6 @@
-import io
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
@@ -10,6 +11,16 @@ from PIL import Image
 # Physical constants
 STANDARD_GRAVITY_M_PER_S2: float = 9.80665
 
+# Decode the whole (time, lat, lon) cube up front when this budget holds ~3x its size at peak:
+# xarray's cached decode, the float32 metres and the longitude-shifted copy
+PRELOAD_MAX_BYTES: int = 4 * 1024 ** 3
+
+# Otherwise decode this many timesteps per read (one week of hourly frames)
+TIME_BLOCK: int = 168
+
+# Frames encode independently; one worker per core
+WORKERS: int = os.cpu_count() or 1
+
 
 def resolve_paths(pressureLevel):
     """Return absolute paths for project root, data dir, grib path, and output dir."""
@@ -23,8 +34,14 @@ def resolve_paths(pressureLevel):
 
 
 def open_era5_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -44,44 +61,77 @@ def select_gph_z(era5_ds: xr.Dataset, pressureLevel) -> xr.DataArray:
     return da
 
 
+# Per-process scratch arrays, reused across frames
+_scratch_buffers: dict = {}
+
+
+def scratch_buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    key = (name, shape, np.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = _scratch_buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
 def to_minus180_180(lon_1d: np.ndarray, elev_m: np.ndarray):
-    lon = lon_1d.copy()
+    lon = lon_1d
     nx = lon.size
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
         return lon, elev_m
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((elev_m[..., cut:], elev_m[..., :cut]), axis=-1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    elev_rot = np.roll(elev_m, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    elev_sorted = elev_m[..., (order - shift) % nx]
     lon_sorted = lon_rot[order]
-    elev_sorted = elev_rot[:, order]
     return lon_sorted, elev_sorted
 
 
-def encode_terrain_rgb_png(elev_m: np.ndarray, lat: np.ndarray, lon: np.ndarray):
-    scaled = np.round((elev_m + 10000.0) / 0.1).astype(np.uint32)
-    r = (scaled >> 16) & 255
-    g = (scaled >> 8) & 255
-    b = scaled & 255
-    rgba = np.dstack([
-        r.astype(np.uint8),
-        g.astype(np.uint8),
-        b.astype(np.uint8),
-        np.full_like(r, 255, dtype=np.uint8),
-    ])
-    image = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
+def terrain_rgb_image(elev_m: np.ndarray) -> Image.Image:
     ny, nx = elev_m.shape
-    min_lon = float(lon[0]) if lon[0] <= lon[-1] else float(lon[-1])
-    max_lon = float(lon[-1]) if lon[-1] >= lon[0] else float(lon[0])
-    min_lat = float(lat[0]) if lat[0] <= lat[-1] else float(lat[-1])
-    max_lat = float(lat[-1]) if lat[-1] >= lat[0] else float(lat[0])
-    bounds = (min_lon, min_lat, max_lon, max_lat)
-    return buf.read(), bounds, nx, ny
+    # (elev + 10000) / 0.1 rounded half-up, computed in place in reused buffers
+    scaled_f = scratch_buffer("scaled_f", elev_m.shape, np.float32)
+    np.add(elev_m, np.float32(10000.0), out=scaled_f)
+    scaled_f *= np.float32(10.0)
+    scaled_f += np.float32(0.5)
+    scaled = scratch_buffer("scaled", elev_m.shape, np.uint32)
+    np.copyto(scaled, scaled_f, casting="unsafe")
+    # One 32-bit store per pixel: 0xRRGGBBAA stored big-endian is exactly the RGBA byte order
+    scaled <<= 8
+    scaled |= 255
+    packed = scratch_buffer("packed", elev_m.shape, ">u4")
+    np.copyto(packed, scaled)
+    # Wrap the packed bytes without another copy (raw RGBA, top row first)
+    return Image.frombuffer("RGBA", (nx, ny), packed, "raw", "RGBA", 0, 1)
+
+
+def timestamp_strings(times: np.ndarray) -> np.ndarray:
+    """YYYYMMDDHH for every timestep, formatted in one vectorized pass."""
+    iso = np.datetime_as_string(times, unit="h")  # YYYY-MM-DDTHH
+    return np.char.replace(np.char.replace(iso, "-", ""), "T", "")
+
+
+def write_gph_images(job) -> str:
+    png_path, webp_path, elev_fixed = job
+    # Quantize and pack once; the PNG and the WebP carry the same Terrain-RGB pixels
+    image = terrain_rgb_image(elev_fixed)
+    # zlib level 1: much faster, slightly larger
+    image.save(png_path, format="PNG", compress_level=1, optimize=False)
+    if webp_path is not None:
+        # Lossless WebP (~30% smaller); quality is encoder effort there, 0/method 0 is the fastest
+        image.save(webp_path, format="WEBP", lossless=True, quality=0, method=0)
+    return png_path
 
 
 def main():
@@ -90,6 +140,7 @@ def main():
     out_dir = f"/mnt/c/Users/dmmsp/Projects/Hurricane-Explainer-Engine/data/gphImages/{pressureLevel}"
     os.makedirs(out_dir, exist_ok=True)
     # _, _, _, out_dir = resolve_paths(pressureLevel)
+    write_webp = False  # also write gph_{ts}.webp, served by the backend to clients accepting image/webp
 
     ds = open_era5_dataset(grib_path)
     gphZ_data = select_gph_z(ds, pressureLevel)
@@ -116,30 +167,57 @@ def main():
     covers_expected = (start_dt <= np.datetime64(expected_start)) and (end_dt >= np.datetime64(expected_end))
     print(f"Covers expected 2017080100..2017093023: {covers_expected}")
 
+    # One GRIB decode for the whole run instead of one per timestep
+    gph_m_all = None
+    if 3 * gphZ_data.nbytes <= PRELOAD_MAX_BYTES:
+        gph_m_all = np.divide(gphZ_data.transpose(time_coord, "latitude", "longitude").values, STANDARD_GRAVITY_M_PER_S2, dtype=np.float32)
+
+    # Flip north-up and shift to [-180,180) once
+    flip_lat = lat[0] < lat[-1]
+    if gph_m_all is not None:
+        if flip_lat:
+            gph_m_all = gph_m_all[:, ::-1, :]
+        _, gph_m_all = to_minus180_180(lon, gph_m_all)
+
     total = len(times)
-    for idx, t in enumerate(times, start=1):
-        # Format YYYYMMDDHH
-        ts = np.datetime_as_string(t, unit="h").replace("-", "").replace(":", "").replace("T", "")
-        png_path = os.path.join(out_dir, f"gph_{ts}.png")
-        # if os.path.exists(png_path):
-            # if idx % 100 == 0:
-                # print(f"[{idx}/{total}] Exists, skipping: {os.path.basename(png_path)}")
-            # continue
-        slice_da = (gphZ_data.sel({time_coord: np.datetime64(t)}) / STANDARD_GRAVITY_M_PER_S2)
-        elev_m = slice_da.values.astype(np.float32)
-
-        lon_fixed, elev_fixed = to_minus180_180(lon, elev_m)
-        lat_work = lat.copy()
-        if lat_work[0] < lat_work[-1]:
-            elev_fixed = elev_fixed[::-1, :]
-            lat_work = lat_work[::-1]
-
-        png_bytes, _, _, _ = encode_terrain_rgb_png(elev_fixed, lat_work, lon_fixed)
-        with open(png_path, "wb") as f:
-            f.write(png_bytes)
-
-        if idx % 50 == 0 or idx == total:
-            print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
+    stamps = timestamp_strings(times)
+    # The pool takes whole blocks at a time, so only the lazy path needs to bound how much is decoded at once
+    block_size = max(total, 1) if gph_m_all is not None else TIME_BLOCK
+
+    def load_block(b0):
+        if gph_m_all is not None:
+            return gph_m_all[b0:b0 + block_size]
+        block = np.divide(gphZ_data.isel({time_coord: slice(b0, b0 + block_size)}).transpose(time_coord, "latitude", "longitude").values, STANDARD_GRAVITY_M_PER_S2, dtype=np.float32)
+        if flip_lat:
+            block = block[:, ::-1, :]
+        _, block = to_minus180_180(lon, block)
+        return block
+
+    starts = range(0, total, block_size)
+    # Decode the next block while the pool encodes this one
+    # Don't fork while the reader thread may hold locks
+    pool_context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=WORKERS, mp_context=pool_context) as pool, ThreadPoolExecutor(max_workers=1) as reader:
+        next_block = reader.submit(load_block, starts[0]) if starts else None
+        for n, b0 in enumerate(starts):
+            block = next_block.result()
+            if n + 1 < len(starts):
+                next_block = reader.submit(load_block, starts[n + 1])
+
+            jobs = []
+            for j, ts in enumerate(stamps[b0:b0 + block_size]):
+                png_path = os.path.join(out_dir, f"gph_{ts}.png")
+                # if os.path.exists(png_path):
+                    # if idx % 100 == 0:
+                        # print(f"[{idx}/{total}] Exists, skipping: {os.path.basename(png_path)}")
+                    # continue
+                webp_path = os.path.join(out_dir, f"gph_{ts}.webp") if write_webp else None
+                jobs.append((png_path, webp_path, block[j]))
+
+            # map keeps time order
+            for idx, png_path in enumerate(pool.map(write_gph_images, jobs, chunksize=4), start=b0 + 1):
+                if idx % 50 == 0 or idx == total:
+                    print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
 
 
 if __name__ == "__main__":
@@ -3,6 +3,7 @@
 import numpy as np
 import rasterio as rio
 from rasterio.enums import Resampling
+from rasterio.windows import Window
 from PIL import Image
 
 GEBCO_NC = "./GEBCO_2025.nc"       # GEBCO NetCDF (CF with lat/lon)
@@ -10,6 +11,7 @@ VAR_NAME = "elevation"             # adjust if different (e.g., "z" or similar)
 OUT_PNG  = "./gebco_4k_uint16.png"
 VMIN, VMAX = 0.0, 10000.0
 W, H = 4096, 2048
+STRIP_ROWS = 128                   # output rows per windowed read; bounds peak memory to one strip of source rows
 
 def main():
     # Open the NetCDF variable as a raster band using subdataset URL
@@ -17,13 +19,20 @@ def main():
     # If VAR_NAME unsure, run: rio.open(GEBCO_NC).subdatasets
     src_path = f"NETCDF:{GEBCO_NC}:{VAR_NAME}"
     with rio.open(src_path) as src:
-        # Read directly at target size with average resampling (streamed)
-        arr = src.read(
-            1,
-            out_shape=(H, W),
-            resampling=Resampling.average,
-            masked=False
-        ).astype(np.float32)
+        # Read at target size with average resampling, one horizontal strip at a time
+        # (fractional windows keep strip edges on the exact source rows for non-integer ratios)
+        arr = np.empty((H, W), dtype=np.float32)
+        src_rows_per_px = src.height / H
+        for r0 in range(0, H, STRIP_ROWS):
+            r1 = min(r0 + STRIP_ROWS, H)
+            window = Window(0, r0 * src_rows_per_px, src.width, (r1 - r0) * src_rows_per_px)
+            arr[r0:r1] = src.read(
+                1,
+                window=window,
+                out_shape=(r1 - r0, W),
+                resampling=Resampling.average,
+                masked=False
+            )
 
     # NaN→0, clamp negatives→0, then clamp to [VMIN, VMAX]
     np.nan_to_num(arr, copy=False, nan=0.0)
@@ -34,7 +43,7 @@ def main():
     scaled = np.rint((arr - VMIN) / (VMAX - VMIN) * 65535.0).astype(np.uint16)
 
     # Save 16-bit grayscale PNG
-    Image.fromarray(scaled, mode="I;16").save(OUT_PNG, optimize=True, compress_level=6)
+    Image.fromarray(scaled, mode="I;16").save(OUT_PNG, optimize=False, compress_level=1)
 
     km_per_px = 40075.017/ W  # rough at equator for equirect
     dz = (VMAX - VMIN) / 65535.0
@@ -18,8 +18,14 @@ def resolve_paths():
 
 
 def open_era5_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -37,35 +43,38 @@ def select_lsm(era5_ds: xr.Dataset) -> xr.DataArray:
 
 
 def to_minus180_180(lon_1d: np.ndarray, arr2d: np.ndarray):
-    lon = lon_1d.copy()
+    lon = lon_1d
     nx = lon.size
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
         return lon, arr2d
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((arr2d[:, cut:], arr2d[:, :cut]), axis=1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    arr_rot = np.roll(arr2d, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    arr_sorted = arr2d[:, (order - shift) % nx]
     lon_sorted = lon_rot[order]
-    arr_sorted = arr_rot[:, order]
     return lon_sorted, arr_sorted
 
 
 def encode_landmask_png(mask_land: np.ndarray, lat: np.ndarray, lon: np.ndarray):
     # mask_land True for land (black), False for sea (white)
-    sea = (~mask_land).astype(np.uint8) * 255
-    rgba = np.dstack([
-        sea,
-        sea,
-        sea,
-        np.full_like(sea, 255, dtype=np.uint8),
-    ])
-    image = Image.fromarray(rgba, mode="RGBA")
+    ny, nx = mask_land.shape
+    # 1-bit PNG: decodes to the same black/white RGBA texture at a fraction of the size and encode time
+    image = Image.fromarray(~mask_land)
     buf = io.BytesIO()
     image.save(buf, format="PNG")
     buf.seek(0)
-    ny, nx = mask_land.shape
     min_lon = float(lon[0]) if lon[0] <= lon[-1] else float(lon[-1])
     max_lon = float(lon[-1]) if lon[-1] >= lon[0] else float(lon[0])
     min_lat = float(lat[0]) if lat[0] <= lat[-1] else float(lat[-1])
@@ -83,18 +92,18 @@ def main():
     lat = lsm_da.latitude.values
     lon = lsm_da.longitude.values
 
-    lsm_vals = lsm_da.values.astype(np.float32)
-    mask_land = lsm_vals > 0.5
+    # Threshold the decoded values directly; a float32 copy first changes nothing for GRIB's float32 data
+    mask_land = lsm_da.values > 0.5
 
-    lon_fixed, mask_fixed = to_minus180_180(lon, mask_land.astype(np.float32))
+    # Shifting columns works on the bool mask directly; no float copy and re-threshold needed
+    lon_fixed, mask_fixed = to_minus180_180(lon, mask_land)
 
-    lat_work = lat.copy()
-    if lat_work[0] < lat_work[-1]:
+    lat_work = lat
+    if lat[0] < lat[-1]:
         mask_fixed = mask_fixed[::-1, :]
-        lat_work = lat_work[::-1]
+        lat_work = lat[::-1]
 
-    mask_fixed_bool = mask_fixed >= 0.5
-    png_bytes, _, _, _ = encode_landmask_png(mask_fixed_bool, lat_work, lon_fixed)
+    png_bytes, _, _, _ = encode_landmask_png(mask_fixed, lat_work, lon_fixed)
 
     with open(out_path, "wb") as f:
         f.write(png_bytes)
@@ -1,11 +1,19 @@
-import io
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 import numpy as np
 import xarray as xr
 from PIL import Image
 
 
+# Timesteps decoded per read: one week of hourly 0.25° frames is ~0.7 GB of float32 (two blocks in flight)
+TIME_BLOCK: int = 168
+
+# Frames encode independently; one worker per core
+WORKERS: int = os.cpu_count() or 1
+
+
 def resolve_paths():
     """Return absolute paths for project root, data dir, uv grib path, and output dir."""
     here = os.path.dirname(os.path.abspath(__file__))
@@ -18,8 +26,14 @@ def resolve_paths():
 
 
 def open_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"UV GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -38,39 +52,69 @@ def select_level_component(ds: xr.Dataset, var_name: str, level_hpa: int) -> xr.
     return da
 
 
-def to_minus180_180(lon_1d: np.ndarray, field_2d: np.ndarray):
-    """Convert lon from [0,360) to [-180,180) and roll columns accordingly."""
-    lon = lon_1d.copy()
+def to_minus180_180(lon_1d: np.ndarray, field: np.ndarray):
+    """Convert lon from [0,360) to [-180,180) and roll columns (last axis) accordingly."""
+    lon = lon_1d
     nx = lon.size
     if nx < 2:
-        return lon, field_2d
+        return lon, field
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
-        return lon, field_2d
+        return lon, field
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((field[..., cut:], field[..., :cut]), axis=-1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    rolled = np.roll(field_2d, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    field_sorted = field[..., (order - shift) % nx]
     lon_sorted = lon_rot[order]
-    field_sorted = rolled[:, order]
     return lon_sorted, field_sorted
 
 
+# Per-process scratch arrays, reused across frames
+_scratch_buffers: dict = {}
+
+
+def scratch_buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    key = (name, shape, np.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = _scratch_buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
 # ---- Fixed-range scaler ----
-def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float, out: np.ndarray = None) -> np.ndarray:
     """
     Linearly scale array to uint8 [0,255] using a fixed [vmin, vmax] range.
     NaNs -> 0. Values outside the range are clipped.
+    Writes into `out` (e.g. one channel of an RGBA buffer) when given.
     """
-    a = a.astype(np.float32)
-    out = np.zeros_like(a, dtype=np.uint8)
+    if out is None:
+        out = np.empty(a.shape, dtype=np.uint8)
     if not np.isfinite(vmin) or not np.isfinite(vmax) or vmax <= vmin:
+        out[...] = 0
         return out
-    scaled = (a - vmin) / (vmax - vmin)
-    scaled = np.clip(scaled * 255.0, 0.0, 255.0)
-    out = scaled.astype(np.uint8)
-    out[~np.isfinite(a)] = 0
+    # Shift, scale and clip in one float32 scratch array
+    scaled = scratch_buffer("scaled", a.shape, np.float32)
+    np.subtract(a, np.float32(vmin), out=scaled, dtype=np.float32)
+    scaled *= np.float32(255.0 / (vmax - vmin))
+    np.clip(scaled, 0.0, 255.0, out=scaled)
+    # Reused NaN/inf mask
+    invalid = scratch_buffer("invalid", a.shape, np.bool_)
+    np.isfinite(a, out=invalid)
+    np.logical_not(invalid, out=invalid)
+    np.copyto(scaled, 0.0, where=invalid)
+    np.copyto(out, scaled, casting="unsafe")
     return out
 
 
@@ -80,25 +124,35 @@ TEMP_RANGES_C = {
     500: (-70.0, 0.0),
     250: (-80.0, -25.0),
 }
+KELVIN_OFFSET = 273.15
 
 
-def encode_temp_r_png(temp_c: np.ndarray, pressure_level: int) -> bytes:
-    """Encode Temperature(°C)->R, G/B=0, A=255 with fixed ranges."""
+def temp_gray_image(temp_k: np.ndarray, pressure_level: int) -> Image.Image:
+    """Temperature (input in K, ranges in °C) as 8-bit grayscale with fixed ranges (decoded as an opaque texture; shader reads .r)."""
     if pressure_level not in TEMP_RANGES_C:
         raise ValueError(f"Unsupported pressure level for fixed ranges: {pressure_level}")
 
+    # Shift the °C range to Kelvin instead of converting the field: the scaler subtracts vmin anyway
     tmin, tmax = TEMP_RANGES_C[pressure_level]
+    tmin_k, tmax_k = tmin + KELVIN_OFFSET, tmax + KELVIN_OFFSET
+
+    # Single channel: a quarter of the RGBA bytes to deflate and store
+    gray = scratch_buffer("gray", temp_k.shape, np.uint8)
+    scale_fixed_range(temp_k, tmin_k, tmax_k, out=gray)
+    return Image.fromarray(gray)
+
+
+def timestamp_strings(times: np.ndarray) -> np.ndarray:
+    """YYYYMMDDHH for every timestep, formatted in one vectorized pass."""
+    iso = np.datetime_as_string(times, unit="h")  # YYYY-MM-DDTHH
+    return np.char.replace(np.char.replace(iso, "-", ""), "T", "")
 
-    r = scale_fixed_range(temp_c, tmin, tmax)
-    zeros = np.zeros_like(r, dtype=np.uint8)
-    a = np.full_like(r, 255, dtype=np.uint8)
 
-    rgba = np.dstack([r, zeros, zeros, a])
-    image = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.read()
+def write_temp_png(job) -> str:
+    png_path, t_fixed_k, pressure_level = job
+    # zlib level 1: much faster, slightly larger
+    temp_gray_image(t_fixed_k, pressure_level).save(png_path, format="PNG", compress_level=1, optimize=False)
+    return png_path
 
 
 def main():
@@ -107,6 +161,7 @@ def main():
     grib_path = "."  # set to your GRIB path
     out_dir = f"../data/temp_images/{pressureLevel}"
     os.makedirs(out_dir, exist_ok=True)
+    skip_existing = True  # keep frames written by an earlier run; set False to regenerate everything
 
     ds = open_dataset(grib_path)
 
@@ -131,11 +186,12 @@ def main():
         print("No time steps found in dataset")
         return
 
-    # Fixed date window
+    # Times are sorted, so the window is one index range
     start_np = np.datetime64("2017-08-01T00")
     end_np   = np.datetime64("2017-09-30T23")
-    mask = (times >= start_np) & (times <= end_np)
-    selected_times = times[mask]
+    i_start = int(np.searchsorted(times, start_np, side="left"))
+    i_end = int(np.searchsorted(times, end_np, side="right"))
+    selected_times = times[i_start:i_end]
     if selected_times.size == 0:
         t0 = np.datetime_as_string(times[0], unit="h")
         tN = np.datetime_as_string(times[-1], unit="h")
@@ -148,47 +204,49 @@ def main():
     t0 = np.datetime_as_string(times[0], unit="h")
     tN = np.datetime_as_string(times[-1], unit="h")
     print(f"Dataset time range: {t0} .. {tN}")
-    total = selected_times.size
-
-    # Precompute lon/lat transform for bounds and orientation
-    lon_fixed, _ = to_minus180_180(lon, np.zeros((lat.size, lon.size), dtype=np.float32))
-    lat_work = lat.copy()
-    flip_lat = False
-    if lat_work[0] < lat_work[-1]:
-        lat_work = lat_work[::-1]
-        flip_lat = True
-
-    for idx, t in enumerate(selected_times, start=1):
-        ts = np.datetime_as_string(t, unit="h").replace("-", "").replace(":", "").replace("T", "")
-        png_path = os.path.join(out_dir, f"temp_{ts}.png")
-
-        # Extract slice
-        t_sl = t_da.sel({time_coord: np.datetime64(t)})
-
-        t_vals_k = t_sl.values.astype(np.float32)
-        if t_vals_k.ndim != 2:
-            raise RuntimeError("Unexpected data shape; expected 2D lat-lon for temperature")
-
-        # Convert K -> °C
-        t_vals_c = t_vals_k - 273.15
-
-        # Normalize longitude and latitude orientation
-        lon_t, t_fixed = to_minus180_180(lon, t_vals_c)
-
-        # Keep a consistent lon axis if small numeric differences arise
-        if lon_t.shape != lon_fixed.shape or not np.allclose(lon_t, lon_fixed):
-            lon_fixed = lon_t
 
+    # Skip frames already on disk before any decoding
+    png_paths = []
+    for ts in timestamp_strings(selected_times):
+        png_paths.append(os.path.join(out_dir, f"temp_{ts}.png"))
+    todo = [i for i, png_path in enumerate(png_paths) if not (skip_existing and os.path.exists(png_path))]
+    if len(todo) < selected_times.size:
+        print(f"Skipping {selected_times.size - len(todo)} existing frames")
+    total = len(todo)
+
+    # Orientation is the same for every block
+    flip_lat = lat[0] < lat[-1]
+
+    if t_da.ndim != 3:
+        raise RuntimeError("Unexpected data shape; expected (time, lat, lon) for temperature")
+
+    def load_block(block):
+        # One decode per block of timesteps
+        t_block_k = t_da.isel({time_coord: i_start + np.asarray(block)}).transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+        # Flip north-up and shift to [-180,180) per block; stays in K
         if flip_lat:
-            t_fixed = t_fixed[::-1, :]
-
-        png_bytes = encode_temp_r_png(t_fixed, pressureLevel)
-
-        with open(png_path, "wb") as f:
-            f.write(png_bytes)
-
-        if idx % 50 == 0 or idx == total:
-            print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
+            t_block_k = t_block_k[:, ::-1, :]
+        _, t_block_k = to_minus180_180(lon, t_block_k)
+        return t_block_k
+
+    blocks = [todo[b0:b0 + TIME_BLOCK] for b0 in range(0, total, TIME_BLOCK)]
+    # Decode the next block while the pool encodes this one
+    # Don't fork while the reader thread may hold locks
+    pool_context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=WORKERS, mp_context=pool_context) as pool, ThreadPoolExecutor(max_workers=1) as reader:
+        next_block = reader.submit(load_block, blocks[0]) if blocks else None
+        for n, block in enumerate(blocks):
+            t_block_k = next_block.result()
+            if n + 1 < len(blocks):
+                next_block = reader.submit(load_block, blocks[n + 1])
+            b0 = n * TIME_BLOCK
+
+            jobs = [(png_paths[i], t_block_k[j], pressureLevel) for j, i in enumerate(block)]
+
+            # map keeps time order
+            for idx, png_path in enumerate(pool.map(write_temp_png, jobs, chunksize=4), start=b0 + 1):
+                if idx % 50 == 0 or idx == total:
+                    print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,18 @@
-import io
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import numpy as np
 import xarray as xr
 from PIL import Image
 
 
+# Timesteps decoded per read: one week of hourly 0.25° frames is ~0.7 GB of float32 per component
+TIME_BLOCK: int = 168
+
+# Frames encode independently; one worker per core
+WORKERS: int = os.cpu_count() or 1
+
+
 def resolve_paths():
     """Return absolute paths for project root, data dir, uv grib path, and output dir."""
     here = os.path.dirname(os.path.abspath(__file__))
@@ -18,8 +25,14 @@ def resolve_paths():
 
 
 def open_dataset(path: str) -> xr.Dataset:
+    zarr_path = path + ".zarr"
+    # grib_to_zarr.py output, unless the GRIB was replaced after it was converted
+    if os.path.isdir(zarr_path) and not (os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(zarr_path)):
+        print(f"Opening {zarr_path}")
+        return xr.open_dataset(zarr_path, engine="zarr")
     if not os.path.exists(path):
         raise FileNotFoundError(f"UV GRIB file not found: {path}")
+    print(f"Opening {path}")
     return xr.open_dataset(path, engine="cfgrib")
 
 
@@ -38,39 +51,69 @@ def select_level_component(ds: xr.Dataset, var_name: str, level_hpa: int) -> xr.
     return da
 
 
-def to_minus180_180(lon_1d: np.ndarray, field_2d: np.ndarray):
-    """Convert lon from [0,360) to [-180,180) and roll columns accordingly."""
-    lon = lon_1d.copy()
+def to_minus180_180(lon_1d: np.ndarray, field: np.ndarray):
+    """Convert lon from [0,360) to [-180,180) and roll columns (last axis) accordingly."""
+    lon = lon_1d
     nx = lon.size
     if nx < 2:
-        return lon, field_2d
+        return lon, field
     dlon = float(np.round((lon[1] - lon[0]) * 1e6) / 1e6)
     if lon.min() >= -180 and lon.max() <= 180:
-        return lon, field_2d
+        return lon, field
+    # Regular [0, 360) grid: swap the halves
+    if dlon > 0 and lon[0] >= 0.0 and lon[-1] < 360.0 and np.allclose(np.diff(lon), dlon):
+        cut = int(np.searchsorted(lon, 180.0))
+        lon_out = np.concatenate((lon[cut:] - 360.0, lon[:cut]))
+        return lon_out, np.concatenate((field[..., cut:], field[..., :cut]), axis=-1)
     shift = int(np.round((-180.0 - lon[0]) / dlon)) % nx
-    rolled = np.roll(field_2d, shift=shift, axis=1)
     lon_rot = lon + shift * dlon
     lon_rot = ((lon_rot + 180.0) % 360.0) - 180.0
-    order = np.argsort(lon_rot)
+    # Regular grid: the sort order is a rotation
+    start = int(np.argmin(lon_rot))
+    order = np.concatenate((np.arange(start, nx), np.arange(start)))
+    if np.any(np.diff(lon_rot[order]) <= 0):
+        order = np.argsort(lon_rot)
+    # Roll and reorder in one gather
+    field_sorted = field[..., (order - shift) % nx]
     lon_sorted = lon_rot[order]
-    field_sorted = rolled[:, order]
     return lon_sorted, field_sorted
 
 
+# Per-process scratch arrays, reused across frames
+_scratch_buffers: dict = {}
+
+
+def scratch_buffer(name: str, shape: tuple, dtype) -> np.ndarray:
+    key = (name, shape, np.dtype(dtype))
+    buf = _scratch_buffers.get(key)
+    if buf is None:
+        buf = _scratch_buffers[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+
 # ---- Fixed-range scaler ----
-def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+def scale_fixed_range(a: np.ndarray, vmin: float, vmax: float, out: np.ndarray = None) -> np.ndarray:
     """
     Linearly scale array to uint8 [0,255] using a fixed [vmin, vmax] range.
     NaNs -> 0. Values outside the range are clipped.
+    Writes into `out` (e.g. one channel of an RGBA buffer) when given.
     """
-    a = a.astype(np.float32)
-    out = np.zeros_like(a, dtype=np.uint8)
+    if out is None:
+        out = np.empty(a.shape, dtype=np.uint8)
     if not np.isfinite(vmin) or not np.isfinite(vmax) or vmax <= vmin:
+        out[...] = 0
         return out
-    scaled = (a - vmin) / (vmax - vmin)
-    scaled = np.clip(scaled * 255.0, 0.0, 255.0)
-    out = scaled.astype(np.uint8)
-    out[~np.isfinite(a)] = 0
+    # Shift, scale and clip in one float32 scratch array
+    scaled = scratch_buffer("scaled", a.shape, np.float32)
+    np.subtract(a, np.float32(vmin), out=scaled, dtype=np.float32)
+    scaled *= np.float32(255.0 / (vmax - vmin))
+    np.clip(scaled, 0.0, 255.0, out=scaled)
+    # Reused NaN/inf mask
+    invalid = scratch_buffer("invalid", a.shape, np.bool_)
+    np.isfinite(a, out=invalid)
+    np.logical_not(invalid, out=invalid)
+    np.copyto(scaled, 0.0, where=invalid)
+    np.copyto(out, scaled, casting="unsafe")
     return out
 
 
@@ -83,26 +126,34 @@ UV_RANGES_MPS = {
 Z_RANGE_MPS = (-5.0, 5.0)
 
 
-def encode_uvz_rgb_png(u: np.ndarray, v: np.ndarray, z: np.ndarray, pressure_level: int) -> bytes:
-    """Encode U->R, V->G, Z->B (A=255) with fixed ranges."""
+def uvz_rgb_image(u: np.ndarray, v: np.ndarray, z: np.ndarray, pressure_level: int) -> Image.Image:
+    """U->R, V->G, Z->B with fixed ranges (opaque RGB, no alpha channel)."""
     if pressure_level not in UV_RANGES_MPS:
         raise ValueError(f"Unsupported pressure level for fixed ranges: {pressure_level}")
 
-    umin, umax = UV_RANGES_MPS[pressure_level]
-    vmin, vmax = UV_RANGES_MPS[pressure_level]
+    # U and V share one symmetric range per level
+    uv_min, uv_max = UV_RANGES_MPS[pressure_level]
     zmin, zmax = Z_RANGE_MPS
 
-    r = scale_fixed_range(u, umin, umax)
-    g = scale_fixed_range(v, vmin, vmax)
-    b = scale_fixed_range(z, zmin, zmax)
-    a = np.full_like(r, 255, dtype=np.uint8)
+    # Write channels straight into one RGB buffer reused across frames; a constant alpha would only add bytes to deflate
+    rgb = scratch_buffer("rgb", u.shape + (3,), np.uint8)
+    scale_fixed_range(u, uv_min, uv_max, out=rgb[..., 0])
+    scale_fixed_range(v, uv_min, uv_max, out=rgb[..., 1])
+    scale_fixed_range(z, zmin, zmax, out=rgb[..., 2])
+    return Image.fromarray(rgb)
+
+
+def timestamp_strings(times: np.ndarray) -> np.ndarray:
+    """YYYYMMDDHH for every timestep, formatted in one vectorized pass."""
+    iso = np.datetime_as_string(times, unit="h")  # YYYY-MM-DDTHH
+    return np.char.replace(np.char.replace(iso, "-", ""), "T", "")
+
 
-    rgba = np.dstack([r, g, b, a])
-    image = Image.fromarray(rgba, mode="RGBA")
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.read()
+def write_uvz_png(job) -> str:
+    png_path, u_fixed, v_fixed, w_fixed, pressure_level = job
+    # zlib level 1: much faster, slightly larger
+    uvz_rgb_image(u_fixed, v_fixed, w_fixed, pressure_level).save(png_path, format="PNG", compress_level=1, optimize=False)
+    return png_path
 
 
 def main():
@@ -137,11 +188,12 @@ def main():
         print("No time steps found in dataset")
         return
 
-    # Fixed date window
+    # Times are sorted, so the window is one index range
     start_np = np.datetime64("2017-08-01T00")
     end_np   = np.datetime64("2017-09-30T23")
-    mask = (times >= start_np) & (times <= end_np)
-    selected_times = times[mask]
+    i_start = int(np.searchsorted(times, start_np, side="left"))
+    i_end = int(np.searchsorted(times, end_np, side="right"))
+    selected_times = times[i_start:i_end]
     if selected_times.size == 0:
         t0 = np.datetime_as_string(times[0], unit="h")
         tN = np.datetime_as_string(times[-1], unit="h")
@@ -156,51 +208,38 @@ def main():
     print(f"Dataset time range: {t0} .. {tN}")
     total = selected_times.size
 
-    # Precompute lon/lat transform for bounds and orientation
-    lon_fixed, _ = to_minus180_180(lon, np.zeros((lat.size, lon.size), dtype=np.float32))
-    lat_work = lat.copy()
-    flip_lat = False
-    if lat_work[0] < lat_work[-1]:
-        lat_work = lat_work[::-1]
-        flip_lat = True
-
-    for idx, t in enumerate(selected_times, start=1):
-        ts = np.datetime_as_string(t, unit="h").replace("-", "").replace(":", "").replace("T", "")
-        png_path = os.path.join(out_dir, f"uv_{ts}.png")
-
-        # Extract slices
-        u_sl = u_da.sel({time_coord: np.datetime64(t)})
-        v_sl = v_da.sel({time_coord: np.datetime64(t)})
-        w_sl = w_da.sel({time_coord: np.datetime64(t)})
-
-        u_vals = u_sl.values.astype(np.float32)
-        v_vals = v_sl.values.astype(np.float32)
-        w_vals = w_sl.values.astype(np.float32)
-
-        if u_vals.ndim != 2 or v_vals.ndim != 2 or w_vals.ndim != 2:
-            raise RuntimeError("Unexpected data shape; expected 2D lat-lon for u, v, and w")
-
-        # Normalize longitude and latitude orientation
-        lon_u, u_fixed = to_minus180_180(lon, u_vals)
-        lon_v, v_fixed = to_minus180_180(lon, v_vals)
-        lon_w, w_fixed = to_minus180_180(lon, w_vals)
-
-        # Keep a consistent lon axis if small numeric differences arise
-        if lon_u.shape != lon_fixed.shape or not np.allclose(lon_u, lon_fixed):
-            lon_fixed = lon_u
-
-        if flip_lat:
-            u_fixed = u_fixed[::-1, :]
-            v_fixed = v_fixed[::-1, :]
-            w_fixed = w_fixed[::-1, :]
-
-        png_bytes = encode_uvz_rgb_png(u_fixed, v_fixed, w_fixed, pressureLevel)
-
-        with open(png_path, "wb") as f:
-            f.write(png_bytes)
-
-        if idx % 50 == 0 or idx == total:
-            print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
+    # Ensure latitude descending (north->south) for output consistency
+    flip_lat = lat[0] < lat[-1]
+
+    stamps = timestamp_strings(selected_times)
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        for b0 in range(0, total, TIME_BLOCK):
+            # One decode per block of timesteps
+            sl = slice(i_start + b0, i_start + min(b0 + TIME_BLOCK, total))
+            u_block = u_da.isel({time_coord: sl}).transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+            v_block = v_da.isel({time_coord: sl}).transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+            w_block = w_da.isel({time_coord: sl}).transpose(time_coord, "latitude", "longitude").values.astype(np.float32, copy=False)
+
+            if u_block.ndim != 3 or v_block.ndim != 3 or w_block.ndim != 3:
+                raise RuntimeError("Unexpected data shape; expected (time, lat, lon) for u, v, and w")
+
+            # Flip north-up and shift to [-180,180) once per block
+            if flip_lat:
+                u_block = u_block[:, ::-1, :]
+                v_block = v_block[:, ::-1, :]
+                w_block = w_block[:, ::-1, :]
+            _, u_block = to_minus180_180(lon, u_block)
+            _, v_block = to_minus180_180(lon, v_block)
+            _, w_block = to_minus180_180(lon, w_block)
+
+            jobs = []
+            for u_fixed, v_fixed, w_fixed, ts in zip(u_block, v_block, w_block, stamps[b0:b0 + TIME_BLOCK]):
+                jobs.append((os.path.join(out_dir, f"uv_{ts}.png"), u_fixed, v_fixed, w_fixed, pressureLevel))
+
+            # map keeps time order
+            for idx, png_path in enumerate(pool.map(write_uvz_png, jobs, chunksize=4), start=b0 + 1):
+                if idx % 50 == 0 or idx == total:
+                    print(f"[{idx}/{total}] Wrote {os.path.basename(png_path)}")
 
 
 if __name__ == "__main__":
@@ -26,15 +26,18 @@ from PIL import Image
 import matplotlib.pyplot as plt
 
 
+# Map to [-1, 1]; 127.5 ≈ 0 reference. Only 256 possible channel values, so decode is a table lookup.
+_DECODE_LUT = (np.arange(256, dtype=np.float32) - 127.5) / 127.5
+
+
 def decode_rg_to_uv(r: np.ndarray, g: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """
-    Map 0..255 channel values to a symmetric range [-1, 1] so that
+    Map 0..255 channel values (uint8) to a symmetric range [-1, 1] so that
     direction can be inferred. This is an approximation because the
     source was min-max scaled per slice.
     """
-    # Map to [-1, 1]; 127.5 ≈ 0 reference.
-    u = (r.astype(np.float32) - 127.5) / 127.5
-    v = (g.astype(np.float32) - 127.5) / 127.5
+    u = np.take(_DECODE_LUT, r)
+    v = np.take(_DECODE_LUT, g)
     return u, v
 
 
@@ -52,7 +55,7 @@ def quiver_from_uv_png(
     Parameters
     ----------
     png_path : str | Path
-        Path to the input PNG (RGBA). R=U, G=V, B ignored, A optional.
+        Path to the input PNG (RGB or RGBA). R=U, G=V, B ignored, A optional.
     out_png : str | Path, optional
         If provided, save the figure here.
     stride : int, default 8
@@ -66,36 +69,34 @@ def quiver_from_uv_png(
         Line width for arrows.
     """
     png_path = Path(png_path)
-    img = Image.open(png_path).convert("RGBA")
-    arr = np.array(img)  # H x W x 4
+    img = Image.open(png_path).convert("RGB")
+    arr = np.array(img)  # H x W x 3
     H, W, _ = arr.shape
 
-    # Extract channels
-    r = arr[..., 0]
-    g = arr[..., 1]
+    # Only every stride-th pixel becomes an arrow; subsample before decoding
+    sl_y = slice(0, H, stride)
+    sl_x = slice(0, W, stride)
+    r = arr[sl_y, sl_x, 0]
+    g = arr[sl_y, sl_x, 1]
 
     # Decode approximate U, V and normalize to unit vectors (direction only)
     u, v = decode_rg_to_uv(r, g)
     mag = np.hypot(u, v)
     # Mask tiny magnitudes (avoid NaNs/flat regions); keep direction only
     eps = 1e-6
-    u_dir = np.where(mag > eps, u / (mag + 1e-12), 0.0)
-    v_dir = np.where(mag > eps, v / (mag + 1e-12), 0.0)
+    # One reciprocal shared by both components instead of two divisions
+    inv = np.where(mag > eps, 1.0 / (mag + 1e-12), 0.0).astype(np.float32, copy=False)
+    U = u * inv
+    V = v * inv
 
     # Build lon/lat grids for an equirectangular map at 0.25° resolution.
     # Width W ≈ 1440 => 360 / 0.25; Height H ≈ 721 => 180 / 0.25 + 1.
     # We'll use pixel-center coordinates.
     dlon = 360.0 / W
     dlat = 180.0 / (H - 1) if H > 1 else 180.0  # includes both poles
-    lon = (-180.0 + dlon/2.0) + dlon * np.arange(W)
-    lat = (90.0 - dlat * np.arange(H))  # top row ≈ 90N
-
-    # Subsample
-    sl_y = slice(0, H, stride)
-    sl_x = slice(0, W, stride)
-    Lon, Lat = np.meshgrid(lon[sl_x], lat[sl_y])
-    U = u_dir[sl_y, sl_x]
-    V = v_dir[sl_y, sl_x]
+    lon = (-180.0 + dlon/2.0) + dlon * np.arange(0, W, stride)
+    lat = (90.0 - dlat * np.arange(0, H, stride))  # top row ≈ 90N
+    Lon, Lat = np.meshgrid(lon, lat)
 
     # Matplotlib uses X→east (lon), Y→north (lat). Our V should be +north.
     # The PNG was written with north at the top, so no flip is needed here.